@@ -1,12 +1,30 @@
+import asyncio
 import configparser
+from dataclasses import dataclass
+import functools
 import sys
 import telegram
+from telegram.request import HTTPXRequest
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-import requests
+import httpx
+import orjson
 import io
+import os
+import pickle
+import tempfile
+import time
 
 # --- Configuration ---
+@dataclass(frozen=True)
+class Config:
+    telegram_token: str
+    chat_ids: tuple
+    alpha_vantage_key: str
+    finnhub_key: str
+
+@functools.lru_cache(maxsize=1)
 def load_config():
     """Loads all API keys and chat IDs from config.ini"""
     config = configparser.ConfigParser()
@@ -18,149 +36,385 @@ def load_config():
     if not chat_ids_str:
         raise ValueError("'chat_ids' not found or is empty in config.ini")
     
-    chat_ids = [item.strip() for item in chat_ids_str.split(',')]
+    chat_ids = tuple(item.strip() for item in chat_ids_str.split(','))
     
-    return {
-        'telegram_token': config['telegram']['bot_token'],
-        'chat_ids': chat_ids,
-        'alpha_vantage_key': config['alpha_vantage']['api_key'],
-        'finnhub_key': config['finnhub']['api_key']
-    }
+    return Config(
+        telegram_token=config['telegram']['bot_token'],
+        chat_ids=chat_ids,
+        alpha_vantage_key=config['alpha_vantage']['api_key'],
+        finnhub_key=config['finnhub']['api_key']
+    )
+
+# --- HTTP Client ---
+REQUEST_TIMEOUT = httpx.Timeout(15, connect=5)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def create_http_client():
+    """Builds the pooled HTTP/2 client shared by both IPO sources for one job."""
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=3,  # connection-level retries; status retries are handled in fetch()
+        limits=httpx.Limits(max_connections=4, max_keepalive_connections=4)
+    )
+    return httpx.AsyncClient(transport=transport, timeout=REQUEST_TIMEOUT, headers={'Accept-Encoding': 'gzip'})
+
+async def fetch(client, url, retries=3, backoff_factor=0.5):
+    """GETs a URL, retrying with exponential backoff on transient HTTP statuses."""
+    for attempt in range(retries + 1):
+        response = await client.get(url)
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            response.raise_for_status()
+            return response
+        await asyncio.sleep(backoff_factor * 2 ** attempt)
+
+# --- On-disk Cache ---
+CACHE_DIR = '.cache'
+CACHE_TTL = 21600  # 6 hours for the full Alpha Vantage calendar
+WINDOW_CACHE_TTL = 86400  # 24 hours for Finnhub report windows
+
+class FileCache:
+    """Stores pickled DataFrames on disk with a timestamp header and TTL."""
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key, allow_expired=False):
+        """Returns the cached DataFrame, or None if missing or expired."""
+        try:
+            with open(self._path(key), 'rb') as f:
+                entry = pickle.load(f)
+        except Exception:
+            # Missing, truncated, or unloadable (e.g. after a pandas upgrade) entries are misses
+            return None
+        header = entry['header']
+        if not allow_expired and time.time() - header['ts'] > header['ttl']:
+            return None
+        return entry['data']
+
+    def keys(self, prefix=''):
+        """Lists the keys of all stored entries starting with prefix."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [name[:-4] for name in names if name.startswith(prefix) and name.endswith('.pkl')]
+
+    def mtime(self, key):
+        """Returns when the entry was last written, or None if it does not exist."""
+        try:
+            return os.path.getmtime(self._path(key))
+        except OSError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def set(self, key, df, ttl=None):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temp file and swap it in so an interrupted write never leaves a truncated entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump({'header': {'ts': time.time(), 'ttl': ttl or self.ttl}, 'data': df}, f)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (OSError, pickle.PickleError) as e:
+            print(f"Could not write cache entry '{key}'. Error: {e}")
+
+cache = FileCache()
 
 # --- Data Fetching Functions ---
-def get_ipo_data(config):
-    """Fetches, combines, and cleans IPO data from all sources."""
-    print("Fetching all IPO data...")
-    today = datetime.now()
-    future_date = today + timedelta(days=30)
+async def get_ipo_data(config, client, start_date, end_date):
+    """Fetches, combines, and cleans IPO data from all sources for a date range.
+
+    Returns None when no source returned data; a window with no IPOs is an empty frame.
+    """
+    print(f"Fetching all IPO data for {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}...")
     
-    av_ipos = get_alpha_vantage_ipos(config['alpha_vantage_key'])
-    fh_ipos = get_finnhub_ipos(config['finnhub_key'], today.strftime('%Y-%m-%d'), future_date.strftime('%Y-%m-%d'))
+    # Both sources are independent network calls, so fetch them concurrently
+    av_ipos, fh_ipos = await asyncio.gather(
+        get_alpha_vantage_ipos(client, config.alpha_vantage_key),
+        get_finnhub_ipos(client, config.finnhub_key, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+    )
     
-    combined_df = pd.concat([av_ipos, fh_ipos], ignore_index=True) if not (av_ipos.empty and fh_ipos.empty) else pd.DataFrame()
+    # Each source is already unique by symbol, so just drop Finnhub rows Alpha Vantage already has
+    if not av_ipos.empty and not fh_ipos.empty:
+        fh_ipos = fh_ipos[~fh_ipos['symbol'].isin(av_ipos['symbol'])]
+
+    # Only concat when both sources have rows left; otherwise reuse the non-empty frame as-is
+    if av_ipos.empty:
+        combined_df = fh_ipos
+    elif fh_ipos.empty:
+        combined_df = av_ipos
+    else:
+        combined_df = pd.concat([av_ipos, fh_ipos], ignore_index=True, sort=False)
 
     if not combined_df.empty:
-        combined_df['IPO Date'] = pd.to_datetime(combined_df['IPO Date'], errors='coerce')
-        combined_df.dropna(subset=['IPO Date'], inplace=True)
-        combined_df.drop_duplicates(subset=['symbol'], keep='first', inplace=True)
+        combined_df = combined_df.assign(**{'IPO Date': pd.to_datetime(combined_df['IPO Date'], format='%Y-%m-%d', errors='coerce')})
+        combined_df = combined_df.dropna(subset=['IPO Date'])
+        # Alpha Vantage ignores dates, so trim its full calendar to the requested window
+        dates = combined_df['IPO Date'].values
+        combined_df = combined_df[(dates >= np.datetime64(start_date)) & (dates <= np.datetime64(end_date))]
+        # Sort once at ingest so date-range lookups downstream can use searchsorted
+        combined_df = combined_df.sort_values('IPO Date', kind='stable').reset_index(drop=True)
         print(f"Total unique IPOs found: {len(combined_df)}")
         return combined_df
     
     print("No IPO data found from any source.")
-    return pd.DataFrame()
+    return None
+
+async def get_alpha_vantage_ipos(client, api_key):
+    cache_key = 'alpha_vantage_ipo'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        print(f"Alpha Vantage cache hit with {len(cached)} records.")
+        return cached
 
-def get_alpha_vantage_ipos(api_key):
     print("Fetching IPO data from Alpha Vantage...")
     url = f"https://www.alphavantage.co/query?function=IPO_CALENDAR&apikey={api_key}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        df = pd.read_csv(io.StringIO(response.text))
+        response = await fetch(client, url)
+        # Only parse the columns we keep; the rest of the calendar is discarded anyway
+        df = pd.read_csv(
+            io.BytesIO(response.content),
+            usecols=['symbol', 'name', 'ipoDate'],
+            dtype={'symbol': 'string', 'name': 'string', 'ipoDate': 'string'}
+        )
+        # Coerce here rather than in read_csv, which leaves the whole column as strings if one date is bad
+        df['ipoDate'] = pd.to_datetime(df['ipoDate'], format='%Y-%m-%d', errors='coerce')
         df.rename(columns={'name': 'Company Name', 'ipoDate': 'IPO Date'}, inplace=True)
+        # Drop unparseable dates first so they can't shadow a valid row for the same symbol
+        df.dropna(subset=['IPO Date'], inplace=True)
+        df.drop_duplicates(subset=['symbol'], keep='first', inplace=True)
         print(f"Alpha Vantage found {len(df)} records.")
-        return df[['symbol', 'Company Name', 'IPO Date']]
+        df = df[['symbol', 'Company Name', 'IPO Date']]
+        cache.set(cache_key, df)
+        return df
+    except (httpx.HTTPError, ValueError) as e:
+        # FALLBACK: serve the last cached calendar, even if expired. Rate-limit notices arrive
+        # as a 200 JSON body, so a response that won't parse as the CSV counts as a failure too.
+        stale = cache.get(cache_key, allow_expired=True)
+        if stale is not None:
+            print(f"Alpha Vantage request failed, using stale cache. Error: {e}")
+            return stale
+        print(f"Could not fetch Alpha Vantage data. Error: {e}")
+        return pd.DataFrame()
     except Exception as e:
         print(f"Could not fetch or process Alpha Vantage data. Error: {e}")
         return pd.DataFrame()
 
-def get_finnhub_ipos(api_key, start_date, end_date):
+def get_cached_finnhub_window(start_date, end_date, allow_expired=False):
+    """Derives a Finnhub window from the newest cached window that fully covers it.
+
+    Windows that ended before start_date (today) can never cover a report again and are deleted.
+    """
+    prefix = 'finnhub_ipo_'
+    now = time.time()
+    candidates = []
+    for key in cache.keys(prefix):
+        cached_start, _, cached_end = key[len(prefix):].partition('_')
+        # ISO date strings compare in calendar order
+        if cached_end < start_date:
+            cache.delete(key)
+            continue
+        if cached_start <= start_date and end_date <= cached_end:
+            written = cache.mtime(key)
+            if written is not None and (allow_expired or now - written <= WINDOW_CACHE_TTL):
+                candidates.append((written, key))
+
+    for _, key in sorted(candidates, reverse=True):
+        df = cache.get(key, allow_expired=allow_expired)
+        if df is None:
+            continue
+        if df.empty:
+            return df
+        dates = df['IPO Date']
+        return df[(dates >= start_date) & (dates <= end_date)]
+    return None
+
+async def get_finnhub_ipos(client, api_key, start_date, end_date):
+    cache_key = f"finnhub_ipo_{start_date}_{end_date}"
+    cached = get_cached_finnhub_window(start_date, end_date)
+    if cached is not None:
+        print(f"Finnhub cache hit with {len(cached)} records.")
+        return cached
+
     print(f"Fetching IPO data from Finnhub for {start_date} to {end_date}...")
     url = f"https://finnhub.io/api/v1/calendar/ipo?from={start_date}&to={end_date}&token={api_key}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json().get('ipoCalendar', [])
+        response = await fetch(client, url)
+        data = orjson.loads(response.content).get('ipoCalendar', [])
+        # Dedupe the raw dated records by symbol before building the DataFrame
+        seen = set()
+        data = [r for r in data if r.get('date') and r.get('symbol') not in seen and not seen.add(r.get('symbol'))]
         if not data:
             print("Finnhub found 0 records.")
-            return pd.DataFrame()
+            df = pd.DataFrame()
+            cache.set(cache_key, df, ttl=WINDOW_CACHE_TTL)
+            return df
         df = pd.DataFrame(data)
         df.rename(columns={'name': 'Company Name', 'date': 'IPO Date'}, inplace=True)
         if 'symbol' not in df.columns: df['symbol'] = 'N/A'
         print(f"Finnhub found {len(df)} records.")
-        return df[['symbol', 'Company Name', 'IPO Date']]
+        df = df[['symbol', 'Company Name', 'IPO Date']]
+        cache.set(cache_key, df, ttl=WINDOW_CACHE_TTL)
+        return df
+    except (httpx.HTTPError, ValueError) as e:
+        # FALLBACK: serve the newest covering window, even if expired; an unparseable body counts as a failure
+        stale = get_cached_finnhub_window(start_date, end_date, allow_expired=True)
+        if stale is not None:
+            print(f"Finnhub request failed, using stale cache. Error: {e}")
+            return stale
+        print(f"Could not fetch Finnhub data. Error: {e}")
+        return pd.DataFrame()
     except Exception as e:
         print(f"Could not fetch or process Finnhub data. Error: {e}")
         return pd.DataFrame()
 
+# --- Helper function for the date range covered by today's report ---
+def get_report_end_date(today_date):
+    """Returns the last date shown by any section of the report for today's weekday."""
+    day_of_week = today_date.weekday()
+    if day_of_week <= 2:
+        return today_date + timedelta(days=(6 - day_of_week))
+    if day_of_week == 3:
+        return today_date + timedelta(days=10)
+    if day_of_week == 4:
+        return today_date + timedelta(days=9)
+    return today_date + timedelta(days=7)
+
 # --- Helper function for formatting a message for a specific period ---
 def format_ipo_period(df, start_date, end_date, title, empty_message):
-    """Filters a DataFrame for a date range and returns a formatted string."""
+    """Filters a DataFrame for a date range and returns a formatted string.
+
+    Expects df sorted by a precomputed '_date' column (IPO Date at midnight).
+    """
     # Ensure the DataFrame is not empty before proceeding
     if df.empty:
         return f"**{title}**\n_{empty_message}_\n\n"
 
-    mask = (df['IPO Date'] >= start_date) & (df['IPO Date'] <= end_date)
-    period_df = df.loc[mask]
+    dates = df['_date'].values
+    lo = dates.searchsorted(np.datetime64(start_date), 'left')
+    hi = dates.searchsorted(np.datetime64(end_date), 'right')
+    period_df = df.iloc[lo:hi]
     
     if period_df.empty:
         return f"**{title}**\n_{empty_message}_\n\n"
 
-    message = f"**{title}**\n"
-    period_df = period_df.sort_values(by='IPO Date')
-    for date, group in period_df.groupby(period_df['IPO Date'].dt.date):
-        message += f"_{date.strftime('%A, %b %d')}_\n"
-        for _, row in group.iterrows():
-            message += f"- {row['Company Name']} ({row['symbol']})\n"
-        message += "\n"
-    return message
+    # Rows are already sorted by day, so walk contiguous same-day slabs
+    dates = dates[lo:hi]
+    names = period_df['Company Name'].values.astype(str)
+    syms = period_df['symbol'].values.astype(str)
+    bounds = np.concatenate(([0], np.flatnonzero(dates[1:] != dates[:-1]) + 1, [len(dates)]))
 
-# --- MAIN EXECUTION BLOCK ---
-if __name__ == "__main__":
-    print(f"Starting IPO report job at {datetime.now()}...")
-    config = load_config()
-    ipo_data = get_ipo_data(config)
-    bot = telegram.Bot(token=config['telegram_token'])
-    
-    today = datetime.now()
+    parts = [f"**{title}**\n"]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        parts.append(f"_{pd.Timestamp(dates[start]).strftime('%A, %b %d')}_\n")
+        parts.extend(f"- {name} ({sym})\n" for name, sym in zip(names[start:end], syms[start:end]))
+        parts.append("\n")
+    return "".join(parts)
+
+# --- Message Building ---
+def build_report(ipo_data, today):
+    """Builds the day-of-the-week IPO report message for the given data."""
     today_date = pd.to_datetime(today.date())
     day_of_week = today.weekday()
-    
-    message = ""
+    if ipo_data is not None and not ipo_data.empty:
+        # Compute the day key once, shared by every format_ipo_period call below
+        ipo_data = ipo_data.assign(_date=ipo_data['IPO Date'].dt.normalize())
 
-    # --- THE FIX: Check if ipo_data is empty at the very beginning ---
-    if ipo_data.empty:
+    parts = []
+
+    # --- THE FIX: Check if any data was fetched at the very beginning ---
+    if ipo_data is None:
         print("No data retrieved from APIs. Sending simple 'no IPOs' message.")
         day_name = today.strftime('%A')
-        message = f"No IPOs scheduled for today, {day_name}, {today.strftime('%b %d')}."
+        parts = [f"No IPOs scheduled for today, {day_name}, {today.strftime('%b %d')}."]
     else:
         # Day-of-the-week Logic
         if 0 <= day_of_week <= 2:
             day_name = today.strftime('%A')
-            message = f"**IPO Report for {day_name}, {today.strftime('%b %d')}**\n\n"
-            message += format_ipo_period(ipo_data, today_date, today_date, "Today's IPOs", "None for today.")
+            parts = [f"**IPO Report for {day_name}, {today.strftime('%b %d')}**\n\n"]
+            parts.append(format_ipo_period(ipo_data, today_date, today_date, "Today's IPOs", "None for today."))
             start_of_rest_of_week = today_date + timedelta(days=1)
             end_of_week = today_date + timedelta(days=(6 - day_of_week))
             if start_of_rest_of_week <= end_of_week:
-                 message += format_ipo_period(ipo_data, start_of_rest_of_week, end_of_week, "Remainder of This Week", "None for the rest of this week.")
+                 parts.append(format_ipo_period(ipo_data, start_of_rest_of_week, end_of_week, "Remainder of This Week", "None for the rest of this week."))
         elif day_of_week == 3:
-            message = f"**IPO Outlook for Thursday, {today.strftime('%b %d')}**\n\n"
-            message += format_ipo_period(ipo_data, today_date, today_date, "Today's IPOs", "None for today.")
+            parts = [f"**IPO Outlook for Thursday, {today.strftime('%b %d')}**\n\n"]
+            parts.append(format_ipo_period(ipo_data, today_date, today_date, "Today's IPOs", "None for today."))
             fri_date = today_date + timedelta(days=1)
             sun_date = today_date + timedelta(days=3)
-            message += format_ipo_period(ipo_data, fri_date, sun_date, "Remainder of This Week", "None for the rest of this week.")
+            parts.append(format_ipo_period(ipo_data, fri_date, sun_date, "Remainder of This Week", "None for the rest of this week."))
             next_mon = today_date + timedelta(days=4)
             next_sun = next_mon + timedelta(days=6)
-            message += format_ipo_period(ipo_data, next_mon, next_sun, "Next Week's IPOs", "None scheduled for next week yet.")
+            parts.append(format_ipo_period(ipo_data, next_mon, next_sun, "Next Week's IPOs", "None scheduled for next week yet."))
         elif day_of_week == 4:
-            message = f"**IPO Report for Friday, {today.strftime('%b %d')}**\n\n"
-            message += format_ipo_period(ipo_data, today_date, today_date, "Today's IPOs", "None for today.")
+            parts = [f"**IPO Report for Friday, {today.strftime('%b %d')}**\n\n"]
+            parts.append(format_ipo_period(ipo_data, today_date, today_date, "Today's IPOs", "None for today."))
             next_mon = today_date + timedelta(days=3)
             next_sun = next_mon + timedelta(days=6)
-            message += format_ipo_period(ipo_data, next_mon, next_sun, "Next Week's IPOs", "None scheduled for next week yet.")
+            parts.append(format_ipo_period(ipo_data, next_mon, next_sun, "Next Week's IPOs", "None scheduled for next week yet."))
         else:
             end_of_period = today_date + timedelta(days=7)
             title = f"Upcoming IPOs for the Next 7 Days ({today_date.strftime('%b %d')} - {end_of_period.strftime('%b %d')})"
-            message = format_ipo_period(ipo_data, today_date, end_of_period, title, "No IPOs found for the upcoming 7 days.")
+            parts = [format_ipo_period(ipo_data, today_date, end_of_period, title, "No IPOs found for the upcoming 7 days.")]
+
+    message = "".join(parts)
+    # Telegram caps messages at 4096 characters; truncate once for every chat
+    if len(message) > 4096:
+        message = message[:4090] + "\n..."
+    return message
 
-    # Send the final message to all chats
-    for chat_id in config['chat_ids']:
+# --- Telegram Sending ---
+async def send_message(bot, chat_id, message):
+    """Sends the report to one chat; failures are logged so other chats still get it."""
+    try:
+        await bot.send_message(chat_id=chat_id, text=message, parse_mode=telegram.constants.ParseMode.MARKDOWN)
+        print(f"Message sent successfully to chat ID: {chat_id}")
+    except Exception as e:
+        print(f"Failed to send message to chat ID: {chat_id}. Error: {e}")
+
+# --- Job ---
+async def run_job():
+    """Fetches IPO data, builds today's report, and posts it to every chat."""
+    today = datetime.now()
+    print(f"Starting IPO report job at {today}...")
+    config = load_config()
+    today_date = pd.to_datetime(today.date())
+
+    # Only ask the APIs for the window the report will actually display
+    async with create_http_client() as client:
+        ipo_data = await get_ipo_data(config, client, today_date, get_report_end_date(today_date))
+
+    message = build_report(ipo_data, today)
+
+    # Send the final message to all chats concurrently
+    # HTTP/2 lets the concurrent posts share one multiplexed connection
+    request = HTTPXRequest(connection_pool_size=8, http_version='2')
+    bot = telegram.Bot(token=config.telegram_token, request=request, get_updates_request=request)
+    # Open the connection pool directly rather than via Bot.initialize(), which would add a
+    # get_me() round trip whose failure would escape the per-chat error handling
+    await request.initialize()
+    try:
+        await asyncio.gather(*(send_message(bot, chat_id, message) for chat_id in config.chat_ids))
+    finally:
         try:
-            if len(message) > 4096:
-                bot.send_message(chat_id=chat_id, text=message[:4090] + "\n...", parse_mode=telegram.ParseMode.MARKDOWN)
-            else:
-                bot.send_message(chat_id=chat_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
-            print(f"Message sent successfully to chat ID: {chat_id}")
+            await request.shutdown()
         except Exception as e:
-            print(f"Failed to send message to chat ID: {chat_id}. Error: {e}")
-            
-    print("IPO check complete. Exiting.")
\ No newline at end of file
+            print(f"Could not close the Telegram connection. Error: {e}")
+
+    print("IPO check complete. Exiting.")
+
+# --- MAIN EXECUTION BLOCK ---
+if __name__ == "__main__":
+    asyncio.run(run_job())